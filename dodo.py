@@ -10,20 +10,21 @@ capabilities to be employed in defining build tasks.
 
 More about `doit` on https://pydoit.org/.
 """
-from typing import Dict
+from typing import Dict, List
 
 import os
 import sys
 import shutil
+import hashlib
+import subprocess
 from os.path import dirname, exists, isdir
 from posixpath import join as posix_join
 from pathlib import Path
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from doit.action import CmdAction
 
-from scripts.dodolib.helpers import actions_of
-from scripts.dodolib.fsutil import recursive_remove, find_repo_root
+from scripts.dodolib.fsutil import find_glob, purge_named_dirs, find_repo_root
 from scripts.dodolib.netutil import GeckoDownloader, ChromeDownloader
 
 REPO_ROOT = Path(find_repo_root(os.getcwd()))
@@ -99,12 +100,6 @@ def _print(*args, **kw):
     print(*args, **kw)
 
 
-def _osremove(*args, **kw):
-    """Alias for the builtin ``os.remove()`` (see above)."""
-    os.remove(*args, *kw)
-
-
-@lru_cache()
 def getenv() -> Dict[str, str]:
     """Return a dict with suitable OS environment variables to set
     during task executions.
@@ -126,15 +121,20 @@ def getenv() -> Dict[str, str]:
     return envdict
 
 
+# Skip setting env vars on Windows as command execution breaks raising:
+# `Fatal Python error: _Py_HashRandomization_Init:
+# failed to get random numbers to initialize Python`
+# Elsewhere, build the full environment once and share it between all
+# command actions (a plain dict as doit may need to pickle tasks).
+TASK_ENV = None if os.name == 'nt' else {**os.environ, **getenv()}
+
+
 def with_env(command: str) -> CmdAction:
     """Return a CmdAction carrying given command with OS environment set."""
-    # Skip setting env vars on Windows as command execution breaks raising:
-    # `Fatal Python error: _Py_HashRandomization_Init:
-    # failed to get random numbers to initialize Python`
-    if os.name == 'nt':
+    if TASK_ENV is None:
         return CmdAction(command)
 
-    return CmdAction(command, env=getenv())
+    return CmdAction(command, env=TASK_ENV)
 
 
 def task_pylint() -> dict:
@@ -176,11 +176,20 @@ def task_cov_html() -> dict:
 
 
 def clean_temp() -> None:
-    """Remove the temporary stuff."""
-    for thedir in (TEMP_DIR, BUILD_DIR):
-        if exists(thedir):
-            print(f'Removing {thedir} ...')
-            shutil.rmtree(thedir)
+    """Remove the temporary stuff.
+
+    The directories are removed concurrently as `rmtree()` is I/O bound.
+    """
+    existing_dirs = [thedir for thedir in (TEMP_DIR, BUILD_DIR) if exists(thedir)]
+    for thedir in existing_dirs:
+        print(f'Removing {thedir} ...')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(shutil.rmtree, existing_dirs))  # re-raise any errors
+
+
+def _has_any(pattern: str) -> bool:
+    """Return True if any directory within the current one matches glob `pattern`."""
+    return next(find_glob(os.getcwd(), pattern, isdir), None) is not None
 
 
 def task_clean_pycache() -> dict:
@@ -193,8 +202,9 @@ def task_clean_pycache() -> dict:
     return {
         'basename': 'clean-pycache',
         'actions': [
-            (recursive_remove, [os.getcwd(), '**/__pycache__', isdir]),
+            (purge_named_dirs, [os.getcwd(), {'__pycache__'}]),
         ],
+        'uptodate': [lambda: not _has_any('**/__pycache__')],
     }
 
 
@@ -203,8 +213,9 @@ def task_clean_pytyest_cache() -> dict:
     return {
         'basename': 'clean-pytest-cache',
         'actions': [
-            (recursive_remove, [os.getcwd(), '**/.pytest_cache', isdir]),
+            (purge_named_dirs, [os.getcwd(), {'.pytest_cache'}]),
         ],
+        'uptodate': [lambda: not _has_any('**/.pytest_cache')],
     }
 
 
@@ -222,11 +233,9 @@ def task_clean_all() -> dict:
     """Clean up all garbage."""
     return {
         'basename': 'clean-all',
-        'actions': actions_of(
-            task_clean_temp,
-            task_clean_pycache,
-            task_clean_pytyest_cache,
-        ),
+        'actions': None,
+        # as dependencies, the clean tasks are skipped when up-to-date
+        'task_dep': ['clean-temp', 'clean-pycache', 'clean-pytest-cache'],
     }
 
 
@@ -250,29 +259,138 @@ def task_show_env() -> dict:
     }
 
 
+def task_install_geckodriver() -> dict:
+    """Download geckodriver into the virtualenv unless already there."""
+    downloader = GeckoDownloader()
+    return {
+        'basename': 'install-geckodriver',
+        'task_dep': ['venv-create'],
+        'actions': [(downloader.go, [str(WEBDRIVER_DIR)])],
+        'targets': [str(WEBDRIVER_DIR / downloader.driver_filename)],
+        'uptodate': [True],  # only (re)run when the driver is missing
+    }
+
+
+def task_install_chromedriver() -> dict:
+    """Download chromedriver into the virtualenv unless already there."""
+    downloader = ChromeDownloader()
+    return {
+        'basename': 'install-chromedriver',
+        'task_dep': ['venv-create'],
+        'actions': [(downloader.go, [str(WEBDRIVER_DIR)])],
+        'targets': [str(WEBDRIVER_DIR / downloader.driver_filename)],
+        'uptodate': [True],  # only (re)run when the driver is missing
+    }
+
+
 def maybe_create_empty_venv_cmd() -> str:
     """Return a command string for creating a pyton virtualenv if one does not
     exist, otherwise return a shell No-Op.
     """
     if not PYTHON_BIN.exists():
-        shutil.rmtree(VENV_ROOT)
+        if VENV_ROOT.exists():
+            shutil.rmtree(VENV_ROOT)
         return f'python{PY_VER} -m venv {VENV_ROOT}'
 
     return NOOP
 
 
-def task_venv_dev() -> dict:
-    """Set (or update) project's virtual environment."""
+def write_sync_stamp(stamp: str, sources: List[str]) -> None:
+    """Record the sha256 of the installed requirements' `sources` into `stamp`."""
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(Path(source).read_bytes())
+    Path(stamp).write_text(digest.hexdigest() + '\n')
+
+
+def pipe_requirements_into_pip() -> bool:
+    """Install the requirements printed by ``extract_req.py`` by piping them
+    straight into ``pip install -r /dev/stdin`` (POSIX only).
+
+    Unlike a shell pipe, this fails if *either* process fails.
+    """
+    extract_cmd = [str(PYTHON_BIN), str(SCRIPTS_DIR / 'extract_req.py')]
+    pip_cmd = [str(PIP_BIN), 'install', '-Ur', '/dev/stdin']
+    extract = subprocess.Popen(extract_cmd, stdout=subprocess.PIPE, env=TASK_ENV)
+    assert extract.stdout is not None
+    try:
+        # pip output is relayed via print() so that it follows doit's capturing
+        pip = subprocess.Popen(pip_cmd, stdin=extract.stdout, stdout=subprocess.PIPE,
+                               env=TASK_ENV, text=True)
+    except BaseException:
+        extract.kill()
+        extract.wait()
+        raise
+    finally:
+        extract.stdout.close()  # let extract get SIGPIPE if pip exits early
+    assert pip.stdout is not None
+    with pip.stdout:
+        for line in pip.stdout:
+            print(line, end='')
+    pip_rc = pip.wait()
+    extract_rc = extract.wait()
+    if extract_rc or pip_rc:
+        print(f'ERROR: extract_req.py exited with {extract_rc}, pip with {pip_rc}',
+              file=sys.stderr)
+        return False
+    return True
+
+
+def task_venv_create() -> dict:
+    """Create project's virtual environment unless it already exists."""
 
     return {
-        'basename': 'venv-dev',
+        'basename': 'venv-create',
         'actions': [
-            maybe_create_empty_venv_cmd,
+            CmdAction(maybe_create_empty_venv_cmd),
             with_env(f'{PYTHON_BIN} -m pip install  -U pip setuptools wheel'),
-            f'{PYTHON_BIN} {SCRIPTS_DIR / "extract_req.py"} -o requirements.txt',
+        ],
+        'targets': [str(PYTHON_BIN)],
+        'uptodate': [True],  # only (re)run when the interpreter is missing
+    }
+
+
+def task_venv_sync() -> dict:
+    """Install project's requirements if ``pyproject.toml`` changed since
+    the last install.
+    """
+    sync_stamp = VENV_SITE_PACKAGES / '.sync.stamp'
+    sources = ['pyproject.toml', str(SCRIPTS_DIR / 'extract_req.py')]
+    targets = [str(sync_stamp)]
+    if os.name == 'posix':
+        # pipe requirements straight into pip, no intermediate file
+        install_actions = [
+            (pipe_requirements_into_pip,),
+        ]
+    else:
+        extract_cmd = f'{PYTHON_BIN} {SCRIPTS_DIR / "extract_req.py"}'
+        # no /dev/stdin to read requirements from on Windows, the file
+        # is left as a target for `doit clean` to remove
+        install_actions = [
+            f'{extract_cmd} -o requirements.txt',
             with_env(f'{PIP_BIN} install  -Ur requirements.txt'),
-            (_osremove, ['requirements.txt']),
         ]
+        targets.append('requirements.txt')
+
+    return {
+        'basename': 'venv-sync',
+        'task_dep': ['venv-create'],
+        'file_dep': sources,
+        'targets': targets,
+        'actions': install_actions + [
+            (write_sync_stamp, [str(sync_stamp), sources]),
+        ],
+        'clean': True,
+    }
+
+
+def task_venv_dev() -> dict:
+    """Set (or update) project's virtual environment."""
+
+    return {
+        'basename': 'venv-dev',
+        'actions': None,
+        'task_dep': ['venv-create', 'venv-sync'],
     }
 
 
@@ -280,8 +398,6 @@ def task_init() -> dict:
     """Initialize environment after bootstrapping with `init-venv.sh`."""
 
     return {
-        'actions': actions_of(
-            task_clean_all,
-            task_venv_dev,
-        ),
+        'actions': None,
+        'task_dep': ['clean-all', 'venv-dev'],
     }
@@ -2,7 +2,11 @@
 Unit tests for the .. module:: dodolib.fsutils module.
 """
 
+import io
 import os
+import stat
+import tarfile
+import zipfile
 from os.path import exists, isdir
 from pathlib import Path
 
@@ -14,6 +18,7 @@ from scripts.dodolib.fsutil import (
     find_repo_root,
     find_glob,
     recursive_remove,
+    purge_named_dirs,
 )
 from . import (
     fake_fs,  # do not remove fake_fs - used via injection
@@ -56,6 +61,80 @@ def test_unarchive_zip(fake_fs: FakeFs):
     assert get_content(the_dir / 'file-2.txt') == 'Second test file\n'
 
 
+def _create_targz(archive_path: Path, *infos: tarfile.TarInfo) -> None:
+    with tarfile.open(archive_path, 'w:gz') as arch:
+        for info in infos:
+            arch.addfile(info, io.BytesIO(b'x' * info.size) if info.isfile() else None)
+
+
+def _tar_info(name: str, type=tarfile.REGTYPE, mode=0o644, linkname='') -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type, info.mode, info.linkname = type, mode, linkname
+    info.size = 1 if info.isfile() else 0
+    return info
+
+
+def _create_zip(archive_path: Path, *entries) -> None:
+    with zipfile.ZipFile(archive_path, 'w') as arch:
+        for name, mode in entries:
+            info = zipfile.ZipInfo(name)
+            info.external_attr = mode << 16
+            arch.writestr(info, 'x')
+
+
+def test_unarchive_targz_keeps_exec_bit(fake_fs: FakeFs):
+    the_dir = FSROOT / 'work'
+    fake_fs.create_dir(the_dir)
+    _create_targz(the_dir / 'sample.tar.gz', _tar_info('driver', mode=0o755))
+    unarchive(the_dir / 'sample.tar.gz')
+    assert stat.S_IMODE(os.stat(the_dir / 'driver').st_mode) == 0o755
+
+
+def test_unarchive_zip_keeps_exec_bit(fake_fs: FakeFs):
+    the_dir = FSROOT / 'work'
+    fake_fs.create_dir(the_dir)
+    _create_zip(
+        the_dir / 'sample.zip',
+        ('driver', stat.S_IFREG | 0o755),
+        ('link', stat.S_IFLNK | 0o777),
+    )
+    unarchive(the_dir / 'sample.zip')
+    assert stat.S_IMODE(os.stat(the_dir / 'driver').st_mode) == 0o755
+    assert not os.stat(the_dir / 'link').st_mode & 0o111  # symlink mode not applied
+
+
+def test_unarchive_targz_rejects_outside_member(fake_fs: FakeFs):
+    the_dir = FSROOT / 'work'
+    fake_fs.create_dir(the_dir)
+    _create_targz(the_dir / 'sample.tar.gz', _tar_info('../evil'))
+    with pytest.raises(RuntimeError):
+        unarchive(the_dir / 'sample.tar.gz')
+    assert not exists(FSROOT / 'evil')
+
+
+def test_unarchive_targz_rejects_member_through_symlink(fake_fs: FakeFs):
+    the_dir = FSROOT / 'work'
+    fake_fs.create_dir(the_dir)
+    fake_fs.create_dir(FSROOT / 'outside')
+    _create_targz(
+        the_dir / 'sample.tar.gz',
+        _tar_info('link', type=tarfile.SYMTYPE, linkname=str(FSROOT / 'outside')),
+        _tar_info('link/evil'),
+    )
+    with pytest.raises(RuntimeError):
+        unarchive(the_dir / 'sample.tar.gz')
+    assert not exists(FSROOT / 'outside' / 'evil')
+
+
+def test_unarchive_zip_rejects_outside_member(fake_fs: FakeFs):
+    the_dir = FSROOT / 'work'
+    fake_fs.create_dir(the_dir)
+    _create_zip(the_dir / 'sample.zip', ('../evil', stat.S_IFREG | 0o644))
+    with pytest.raises(RuntimeError):
+        unarchive(the_dir / 'sample.zip')
+    assert not exists(FSROOT / 'evil')
+
+
 def test_find_repo_root_success(fake_fs: FakeFs):
     the_path = FSROOT / 'rootdir' / 'project' / 'package' / 'sub_package'
     fake_fs.makedirs(the_path)
@@ -93,6 +172,24 @@ def test_find_glob(fake_fs: FakeFs):
     assert list(find_glob(FSROOT, '**/__dir?__')) == expected
 
 
+def test_find_glob_skips_matched_dirs(fake_fs: FakeFs):
+    fake_fs.create_dir(FSROOT / 'rootdir' / '__pycache__' / '__pycache__')
+    fake_fs.create_dir(FSROOT / 'rootdir' / 'package' / '__pycache__')
+    fake_fs.create_dir(FSROOT / 'rootdir' / '.hidden' / '__pycache__')
+    expected = [
+        '__pycache__',
+        str(Path('package') / '__pycache__'),
+    ]
+    assert list(find_glob(FSROOT / 'rootdir', '**/__pycache__')) == expected
+
+
+def test_find_glob_literal_with_prefix(fake_fs: FakeFs):
+    fake_fs.create_dir(FSROOT / 'rootdir' / 'src' / 'package' / '__pycache__')
+    fake_fs.create_dir(FSROOT / 'rootdir' / 'tests' / '__pycache__')
+    expected = [str(Path('src') / 'package' / '__pycache__')]
+    assert list(find_glob(FSROOT / 'rootdir', 'src/**/__pycache__')) == expected
+
+
 def test_recursive_remove(fake_fs: FakeFs):
     fake_fs.create_dir(FSROOT / 'rootdir' / 'project' / 'package' / '__dir1__')
     fake_fs.create_dir(FSROOT / 'rootdir' / 'project' / '__dir22__')
@@ -104,3 +201,15 @@ def test_recursive_remove(fake_fs: FakeFs):
     assert exists(FSROOT / 'rootdir' / 'project' / '__dir22__')  # excluded by glob pattern
     assert exists(FSROOT / 'rootdir' / '__dir3__')  # excluded by filter
     assert exists(FSROOT / '__dir4__')  # excluded by start dir choice
+
+
+def test_purge_named_dirs(fake_fs: FakeFs):
+    fake_fs.create_dir(FSROOT / 'rootdir' / 'package' / '__pycache__' / 'sub')
+    fake_fs.create_dir(FSROOT / 'rootdir' / '.pytest_cache')
+    fake_fs.create_dir(FSROOT / 'rootdir' / '.venv' / '__pycache__')
+    fake_fs.create_dir(FSROOT / 'rootdir' / 'package' / 'keep')
+    purge_named_dirs(FSROOT / 'rootdir', {'__pycache__', '.pytest_cache'})
+    assert not exists(FSROOT / 'rootdir' / 'package' / '__pycache__')  # removed
+    assert not exists(FSROOT / 'rootdir' / '.pytest_cache')  # removed
+    assert exists(FSROOT / 'rootdir' / '.venv' / '__pycache__')  # hidden dir not walked
+    assert exists(FSROOT / 'rootdir' / 'package' / 'keep')  # not matching
@@ -0,0 +1,47 @@
+"""
+Unit tests for the .. module:: dodolib.netutil module.
+"""
+
+import os
+
+import pytest
+
+from scripts.dodolib import netutil
+from scripts.dodolib.netutil import GeckoDownloader
+
+
+@pytest.fixture
+def installed_gecko(tmp_path) -> GeckoDownloader:
+    """A geckodriver 0.30.0 installed into ``tmp_path``."""
+    downloader = GeckoDownloader()
+    downloader.configure(directory=str(tmp_path), version='0.30.0')
+    (tmp_path / downloader.driver_filename).write_text('')
+    downloader._save_version_file('0.30.0')
+    return downloader
+
+
+def test_gecko_go_skips_installed_version(installed_gecko: GeckoDownloader, monkeypatch):
+    def fail_download(url, fullpath):
+        raise AssertionError(f'unexpected download of {url}')
+
+    monkeypatch.setattr(netutil, 'cached_download_file', fail_download)
+    installed_gecko.go()
+    assert installed_gecko.is_installed('0.30.0')
+
+
+def test_gecko_go_downloads_other_version(installed_gecko: GeckoDownloader, monkeypatch):
+    downloaded = []
+
+    def fake_download(url, fullpath):
+        downloaded.append(url)
+        with open(fullpath, 'w'):
+            pass
+
+    monkeypatch.setattr(netutil, 'cached_download_file', fake_download)
+    monkeypatch.setattr(netutil, 'unarchive', lambda path: None)
+    installed_gecko.configure(version='0.31.0')
+    installed_gecko.go()
+    assert len(downloaded) == 1 and 'v0.31.0' in downloaded[0]
+    assert installed_gecko.is_installed('0.31.0')
+    assert os.listdir(installed_gecko.directory) == sorted(
+        [installed_gecko.driver_filename, 'geckodriver.version'])
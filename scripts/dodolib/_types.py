@@ -2,14 +2,10 @@
 Types for the dodolib library.
 """
 
-from typing import Any, Optional, Union, Callable, Dict
+from typing import Optional, Union, Callable
 from pathlib import Path
 
 # general types
 PathT = Union[str, Path]
 OptString = Optional[str]
-
-# doit action related types
-ActionT = Union[str, tuple]
-TaskFuncT = Callable[[], Dict[str, Any]]
 FilterFuncT = Callable[[PathT], bool]
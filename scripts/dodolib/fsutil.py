@@ -2,45 +2,108 @@
 Filesystem related utilities/helpers for the doit tool targets.
 """
 
-from typing import Generator
+from typing import Generator, Iterable, List, Optional, Tuple
 
 import os
+import re
+import stat
+from fnmatch import translate
 from functools import lru_cache
 from os.path import (
     abspath,
     normpath,
+    normcase,
+    realpath,
     isdir,
     splitext,
     dirname,
     basename,
     join as pjoin,
 )
-from shutil import rmtree
-from glob import glob
+from shutil import copyfileobj, rmtree
 
 from scripts.dodolib._types import PathT, FilterFuncT
 
 
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _ensure_inside(dest_dir: PathT, path: PathT, member_name: str) -> None:
+    """Raise RuntimeError unless `path` - with any symlinks resolved - is
+    located within `dest_dir`."""
+    real_dest_dir = realpath(dest_dir)
+    if os.path.commonpath((real_dest_dir, realpath(path))) != real_dest_dir:
+        raise RuntimeError(f'Archive member {member_name!r} is outside target directory')
+
+
+def _target_path(dest_dir: PathT, member_name: str) -> str:
+    """Return the full path of an archive member extracted into `dest_dir`.
+
+    Symlinks already extracted (or present) in `dest_dir` are followed
+    for the check.
+
+    :raises: RuntimeError if the member would land outside `dest_dir`
+    """
+    target = abspath(pjoin(dest_dir, member_name))
+    _ensure_inside(dest_dir, target, member_name)
+    return target
+
+
+def _copy_member(src, target: str) -> None:
+    """Stream an opened archive member `src` into the `target` file."""
+    os.makedirs(dirname(target), exist_ok=True)
+    with src, open(target, 'wb') as dst:
+        copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
 def unarchive(fullpath: PathT) -> None:
     """Unarchive given full path into its directory considering
     the archive format.
 
+    Archive members are streamed with a large copy buffer rather than
+    the default (16 KiB tar, 8 KiB zip) to keep the syscall count down
+    on big archives.
+
     :param fullpath: the full path of the original archive
     :raises: RuntimeError if arhive type is not supported
     """
     ext = splitext(fullpath)[1]
+    dest_dir = dirname(fullpath)
     if str(fullpath).endswith('.tar.gz') or ext == '.tgz':
         import tarfile
 
+        # the 'data' filter (where available) is a second line of defence
+        extract_kw = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
         with tarfile.open(fullpath, 'r:gz') as tar_arch:
-            tar_arch.extractall(dirname(fullpath))
+            for member in tar_arch.getmembers():
+                target = _target_path(dest_dir, member.name)
+                if member.isdir():
+                    os.makedirs(target, exist_ok=True)
+                elif member.isfile():
+                    _copy_member(tar_arch.extractfile(member), target)
+                    os.chmod(target, member.mode)
+                    os.utime(target, (member.mtime, member.mtime))
+                else:  # links and special files are rare - let tarfile handle them
+                    if member.issym():
+                        _ensure_inside(dest_dir, pjoin(dirname(target), member.linkname), member.name)
+                    elif member.islnk():
+                        _ensure_inside(dest_dir, pjoin(dest_dir, member.linkname), member.name)
+                    tar_arch.extract(member, dest_dir, **extract_kw)
         return
 
     if ext == '.zip':
         import zipfile
 
         with zipfile.ZipFile(fullpath, 'r') as zip_arch:
-            zip_arch.extractall(dirname(fullpath))
+            for info in zip_arch.infolist():
+                target = _target_path(dest_dir, info.filename)
+                if info.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                else:
+                    _copy_member(zip_arch.open(info), target)
+                    mode = info.external_attr >> 16  # unix file type and permissions, if any
+                    if stat.S_ISREG(mode):
+                        os.chmod(target, stat.S_IMODE(mode))
         return
 
     msg = f'Cannot unarchive file {basename(fullpath)} of type {ext!s}'
@@ -51,27 +114,143 @@ def _anyone(path: PathT):
     return True  # any path is accepted
 
 
+_GLOBSTAR = '**'
+_PATTERN_SEP_RE = re.compile(r'[\\/]' if os.name == 'nt' else '/')
+_PATTERN_FLAGS = re.IGNORECASE if os.name == 'nt' else 0
+_MAGIC_RE = re.compile(r'[*?[]')
+
+
+def _parse_simple_globstar(pattern: str) -> Optional[Tuple[List[str], str]]:
+    """Return `(prefix_parts, literal_name)` if `pattern` has the shape
+    `[some/literal/dirs/]**/literal_name`, otherwise None.
+    """
+    parts = [part for part in _PATTERN_SEP_RE.split(pattern) if part]
+    if len(parts) < 2 or parts[-2] != _GLOBSTAR:
+        return None
+    prefix_parts, literal_name = parts[:-2], parts[-1]
+    if any(_MAGIC_RE.search(part) for part in prefix_parts + [literal_name]):
+        return None
+    return prefix_parts, normcase(literal_name)
+
+
+def _compile_glob(pattern: str) -> List:
+    """Split glob `pattern` into its path components, each one precompiled
+    into a `(component, regex)` pair - except for `**` which is kept as is.
+    """
+    parts: list = []
+    for part in _PATTERN_SEP_RE.split(pattern):
+        if not part or (part == _GLOBSTAR and parts and parts[-1] is _GLOBSTAR):
+            continue
+        if part == _GLOBSTAR:
+            parts.append(_GLOBSTAR)
+        else:
+            parts.append((part, re.compile(translate(part), _PATTERN_FLAGS)))
+    return parts
+
+
+def _ishidden(name: str) -> bool:
+    return name[0] == '.'
+
+
+def _walk(
+    the_dir: PathT, prefix: str, parts: List, filter_fn: FilterFuncT
+) -> Generator[str, None, None]:
+    """Scan `the_dir` once, yield names matching the remaining pattern `parts`
+    (prefixed with `prefix`) and recurse into sub-directories only while
+    there is something left to match.
+
+    A directory which is yielded is not descended into - callers are
+    usually about to remove it anyway.
+    """
+    head, rest = parts[0], parts[1:]
+    globstar = head is _GLOBSTAR
+    if globstar and rest:
+        head, rest = rest[0], rest[1:]
+
+    try:
+        with os.scandir(the_dir) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    sub_dirs = []
+    for entry in entries:
+        name = entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if head is _GLOBSTAR:  # trailing `**` matches anything below
+            if not _ishidden(name):
+                if filter_fn(entry.path):
+                    yield prefix + name
+                if is_dir:
+                    sub_dirs.append(entry)
+            continue
+
+        component, regex = head
+        if regex.match(name) and (not _ishidden(name) or _ishidden(component)):
+            if rest:
+                if is_dir:
+                    yield from _walk(entry.path, prefix + name + os.sep, rest, filter_fn)
+            elif filter_fn(entry.path):
+                yield prefix + name
+                continue
+
+        if globstar and is_dir and not _ishidden(name):
+            sub_dirs.append(entry)
+
+    for entry in sub_dirs:
+        yield from _walk(entry.path, prefix + entry.name + os.sep, parts, filter_fn)
+
+
+def _walk_literal(
+    the_dir: PathT, prefix: str, name: str, filter_fn: FilterFuncT
+) -> Generator[str, None, None]:
+    """Specialized :func:`_walk` for `**/name` patterns: a plain name
+    comparison, recursing into every non-hidden, non-matching sub-directory.
+    """
+    try:
+        with os.scandir(the_dir) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    sub_dirs = []
+    for entry in entries:
+        entry_name = entry.name
+        if normcase(entry_name) == name and filter_fn(entry.path):
+            yield prefix + entry_name
+        elif not _ishidden(entry_name) and entry.is_dir(follow_symlinks=False):
+            sub_dirs.append(entry)
+
+    for entry in sub_dirs:
+        yield from _walk_literal(entry.path, prefix + entry.name + os.sep, name, filter_fn)
+
+
 def find_glob(
     root_dir: PathT, pattern: str, filter_fn: FilterFuncT = _anyone
 ) -> Generator[str, None, None]:
     """Yield a sequence of all files or directories matching given glob
     pattern.
 
+    Matched directories are not descended into, so e.g. `**/__pycache__`
+    never walks a cache directory.
+
     :param root_dir: str or Path - the root directory to start looking into
     :param pattern: str - the glob pattern for files and dirs to match
-    :param filter_fn: callable - a boolean filtering function
+    :param filter_fn: callable - a boolean filtering function, called with
+                      the path joined to `root_dir`
     :return: yield a sequence of strings with path names relative to
              `root_dir`.
     """
-    old_cwd = os.getcwd()
+    simple = _parse_simple_globstar(pattern)
+    if simple:
+        prefix_parts, name = simple
+        prefix = ''.join(part + os.sep for part in prefix_parts)
+        yield from _walk_literal(pjoin(root_dir, prefix), prefix, name, filter_fn)
+        return
 
-    try:
-        os.chdir(root_dir)
-        for path in glob(pattern, recursive=True):
-            if filter_fn(path):
-                yield path
-    finally:
-        os.chdir(old_cwd)
+    parts = _compile_glob(pattern)
+    if parts:
+        yield from _walk(root_dir, '', parts, filter_fn)
 
 
 def recursive_remove(root_dir: PathT, pattern: str, filter_fn: FilterFuncT = _anyone) -> None:
@@ -84,7 +263,26 @@ def recursive_remove(root_dir: PathT, pattern: str, filter_fn: FilterFuncT = _an
     :return: None
     """
     for path in find_glob(root_dir, pattern, filter_fn=filter_fn):
-        rmtree(path)
+        rmtree(pjoin(root_dir, path))
+
+
+def purge_named_dirs(root_dir: PathT, names: Iterable[str]) -> None:
+    """Remove all directories with one of given `names`, found recursively
+    within `root_dir`.
+
+    Like the `**` glob, hidden directories are not looked into. Removed
+    directories are not walked either.
+
+    :param root_dir: str or Path - the root directory to start looking into
+    :param names: iterable - exact directory names to remove
+    :return: None
+    """
+    names = frozenset(names)
+    for dirpath, dirnames, _ in os.walk(root_dir):
+        for name in dirnames:
+            if name in names:
+                rmtree(pjoin(dirpath, name))
+        dirnames[:] = [name for name in dirnames if name not in names and not _ishidden(name)]
 
 
 @lru_cache(maxsize=1)
@@ -98,13 +296,12 @@ def find_repo_root(start_dir: PathT = None) -> str:
     start_dir = start_dir if start_dir else os.getcwd()
     curr_dir = abspath(normpath(start_dir))
 
-    def _isdir(short_path):
-        return isdir(pjoin(curr_dir, short_path))
-
-    while curr_dir:
-        sub_dirs = {path for path in os.listdir(curr_dir) if _isdir(path)}
-        if '.git' in sub_dirs:
+    while True:
+        if isdir(pjoin(curr_dir, '.git')):
             return curr_dir
-        curr_dir = curr_dir.rsplit(os.sep, 1)[0]
+        parent_dir = dirname(curr_dir)
+        if parent_dir == curr_dir:
+            break
+        curr_dir = parent_dir
 
     raise RuntimeError(f'Cannot find git repo within {start_dir!r}')
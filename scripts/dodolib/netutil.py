@@ -7,21 +7,37 @@ from typing import Any, Dict, Set
 from abc import ABC, abstractmethod
 
 import os
+import hashlib
 import platform
+import shutil
 from collections import namedtuple
-from os.path import dirname, isfile, join as pjoin
+from os.path import basename, isfile, join as pjoin
+from pathlib import Path
 from posixpath import join as posix_join, sep as posix_sep
-from urllib.error import URLError
 from urllib.parse import urlunparse
-from functools import lru_cache
-from urllib.request import urlopen
+from functools import cached_property, lru_cache
 
 import requests
+from requests.adapters import HTTPAdapter
+
+if os.name == 'nt':
+    import winreg
 
 from scripts.dodolib._types import PathT
 from scripts.dodolib.fsutil import unarchive
 
-DEFAULT_BUFFER_SIZE = 8 * 1024
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Shared session so that consecutive requests reuse pooled connections
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# platform.uname() may spawn a subprocess, so look it up once
+_UNAME = platform.uname()
+_PLATFORM_KEY = f'{_UNAME.system}-{_UNAME.machine}'
+
+# Downloaded archives are kept here, keyed by URL and server-side validators
+DOWNLOAD_CACHE_DIR = Path.home() / '.cache' / 'dodolib-drivers'
 
 
 def download_file(url, path: PathT, buffer_size: int = DEFAULT_BUFFER_SIZE):
@@ -33,13 +49,50 @@ def download_file(url, path: PathT, buffer_size: int = DEFAULT_BUFFER_SIZE):
     :param buffer_size: size of the buffer
     :return:
     """
-    with requests.get(url, stream=True) as resp:
+    with _SESSION.get(url, stream=True) as resp:
         resp.raise_for_status()  # raise HTTPError on status 4xx/5xx
+        resp.raw.decode_content = True  # undo any Content-Encoding
         with open(path, 'wb') as fd:
-            for chunk in resp.iter_content(chunk_size=buffer_size):
-                if not chunk:
-                    continue
-                fd.write(chunk)
+            shutil.copyfileobj(resp.raw, fd, buffer_size)
+
+
+def _cache_key(url: str) -> str:
+    """Return a cache key for the resource at ``url`` based on the ``ETag``
+    and ``Last-Modified`` headers advertised by the server (HEAD request).
+    """
+    resp = _SESSION.head(url, allow_redirects=True, timeout=10)
+    resp.raise_for_status()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (url, resp.headers.get('ETag', ''), resp.headers.get('Last-Modified', '')):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def cached_download_file(url: str, path: PathT) -> None:
+    """Like :func:`download_file` but serve the file from
+    ``DOWNLOAD_CACHE_DIR`` when the server reports it unchanged since
+    the last download.
+
+    :param url: the HTTP url to download the file from
+    :param path: filesystem path location
+    :return:
+    """
+    cached_path = DOWNLOAD_CACHE_DIR / _cache_key(url) / basename(path)
+    if not cached_path.is_file():
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cached_path.with_name(cached_path.name + '.part')
+        download_file(url, tmp_path)
+        os.replace(tmp_path, cached_path)
+    else:
+        print('Using cached', cached_path)
+
+    if isfile(path):
+        os.remove(path)
+    try:
+        os.link(cached_path, path)
+    except OSError:  # e.g. cache and target on different filesystems
+        shutil.copyfile(cached_path, path)
 
 
 def substitute_keywords(template_dict: Dict[str, str], **kw) -> Dict[str, str]:
@@ -54,10 +107,61 @@ def substitute_keywords(template_dict: Dict[str, str], **kw) -> Dict[str, str]:
     return {name: value.format(**kw) for name, value in template_dict.items()}
 
 
+def _browser_version_output(command: list) -> str:
+    """Run a browser binary with ``--version`` and return its output,
+    or an empty string if the binary cannot be run."""
+    try:
+        with subprocess.Popen(command + ['--version'], stdout=subprocess.PIPE) as proc:
+            return proc.stdout.read().decode('utf-8').strip()
+    except OSError:
+        return ''
+
+
+# Chrome/Chromium binary names to try on Linux, in order
+LINUX_CHROME_BINARIES = ('google-chrome', 'google-chrome-stable', 'chromium-browser', 'chromium')
+
+
+@lru_cache(maxsize=1)
+def _linux_chrome_version() -> str:
+    for binary in LINUX_CHROME_BINARIES:
+        version = _browser_version_output([binary])
+        if version:
+            return version
+    return ''
+
+
+@lru_cache(maxsize=1)
+def _mac_chrome_version() -> str:
+    return _browser_version_output(['/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'])
+
+
+@lru_cache(maxsize=1)
+def _win_chrome_version() -> str:
+    try:
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r'Software\Google\Chrome\BLBeacon') as key:
+            version, _ = winreg.QueryValueEx(key, 'version')
+    except OSError:  # Chrome not installed
+        return ''
+    return version
+
+
+_CHROME_VERSION_RE = re.compile(r'\d+\.\d+\.\d+')
+
+# Mapping platform.uname().system to a function returning the raw
+# installed Chrome version string
+_CHROME_VERSION_PROBES = {
+    'Linux': _linux_chrome_version,
+    'Darwin': _mac_chrome_version,
+    'Windows': _win_chrome_version,
+}
+
+
 class DriverDownloader(ABC):
     """Interface for driver-downloader implementations."""
 
     attrnames: Set[str] = set()  # must override in sub-classes
+    driver_name: str = ''  # must override in sub-classes
+    directory: str
 
     def _check_attributes(self, args):
         """Raise TypeError if argument names are not a sub-set of
@@ -72,8 +176,34 @@ class DriverDownloader(ABC):
         for name, value in kwargs.items():
             setattr(self, name, value)
 
+    @property
+    def driver_filename(self) -> str:
+        """Return the file name of the (unarchived) driver executable."""
+        return f'{self.driver_name}.exe' if os.name == 'nt' else self.driver_name
+
+    @property
+    def version_filepath(self) -> str:
+        """Return the full path of the file recording the installed driver version."""
+        return pjoin(self.directory, f'{self.driver_name}.version')
+
+    def _save_version_file(self, version: str) -> None:
+        """Save installed driver version."""
+        with open(self.version_filepath, 'w') as fd:
+            print(self.driver_name, ' ', version, sep='', file=fd)
+
+    def is_installed(self, version: str) -> bool:
+        """Return True if given driver ``version`` is already in ``directory``."""
+        if not isfile(pjoin(self.directory, self.driver_filename)):
+            return False
+        try:
+            with open(self.version_filepath, 'r') as fd:
+                return fd.read().split() == [self.driver_name, version]
+        except OSError:
+            return False
+
+    @property
     @abstractmethod
-    def basename(self, uname=None) -> str:
+    def basename(self) -> str:
         """Return the base name of the file to be downloaded."""
 
     @abstractmethod
@@ -102,6 +232,7 @@ class GeckoDownloader(DriverDownloader):
     }
 
     attrnames = {'directory', 'version'}
+    driver_name = 'geckodriver'
     UrlParts = namedtuple('UrlParts', 'scheme netloc path params query fragment')
 
     def __init__(self):
@@ -110,11 +241,9 @@ class GeckoDownloader(DriverDownloader):
         self.version: str = 'latest'
 
     @property
-    def basename(self, uname=None) -> str:
-        """Get basename."""
-        uname = platform.uname()
-        suffix = self.WEBDRIVER_GECKO_FILE_SUFFIX_MAP[uname.system + '-' + uname.machine]
-        return f'geckodriver-v{self.version}-{suffix}'
+    def basename(self) -> str:
+        """Get basename (not cached as it changes along with ``version``)."""
+        return f'geckodriver-v{self.version}-{self.WEBDRIVER_GECKO_FILE_SUFFIX_MAP[_PLATFORM_KEY]}'
 
     @property
     def main_url(self) -> str:
@@ -127,28 +256,28 @@ class GeckoDownloader(DriverDownloader):
     def get_latest_version(self):
         """Get latest geckodriver version."""
         latest_url = posix_join(self.main_url, 'latest')
-        resp = requests.get(latest_url, allow_redirects=False)
+        resp = _SESSION.head(latest_url, allow_redirects=False, timeout=10)
         assert resp.status_code == 302, f'Expected status code 302, got {resp.status_code}'
         return resp.headers['location'].strip().rsplit(posix_sep)[-1].lstrip('v')
 
-    def _save_version_file(self, fullpath: PathT) -> None:
-        """Save geckodriver version."""
-        with open(pjoin(dirname(fullpath), 'version'), 'w') as fd:
-            print('geckodriver ', self.version, sep='', file=fd)
-
     def go(self, target_dir: PathT = None) -> None:
         """Download geckodriver.exe"""
+        if target_dir is not None:
+            self.directory = target_dir
         if self.version == 'latest':
             self.version = self.get_latest_version()
             print('geckodriver latest version:', self.version)
+        if self.is_installed(self.version):
+            print('geckodriver', self.version, 'already installed')
+            return
 
         download_url = posix_join(self.main_url, 'download', f'v{self.version}', self.basename)
         fullpath = pjoin(self.directory, self.basename)
-        download_file(download_url, fullpath)
+        cached_download_file(download_url, fullpath)
         assert isfile(fullpath), f'FAILED downloading {download_url} into {fullpath}'
         unarchive(fullpath)
         os.remove(fullpath)
-        self._save_version_file(fullpath)
+        self._save_version_file(self.version)
 
 
 class ChromeDownloader(DriverDownloader):
@@ -159,9 +288,12 @@ class ChromeDownloader(DriverDownloader):
         'Linux-x86': 'linux64.zip',
         'Windows-AMD64': 'win32.zip',
         'Windows-x86': 'win32.zip',
+        'Darwin-x86_64': 'mac64.zip',
+        'Darwin-arm64': 'mac_arm64.zip',
     }
 
     attrnames = {'directory', 'version'}
+    driver_name = 'chromedriver'
 
     CHROME_BASE_DOWNLOAD_URL = "https://chromedriver.storage.googleapis.com"
     LATEST_RELEASE_URL = "https://chromedriver.storage.googleapis.com/LATEST_RELEASE"
@@ -170,35 +302,24 @@ class ChromeDownloader(DriverDownloader):
         super().__init__()
         self.directory: str = '/tmp'
 
-    @property
-    def basename(self, uname=None) -> str:
+    @cached_property
+    def basename(self) -> str:
         """Get basename."""
-        uname = platform.uname()
-        suffix = self.WEBDRIVER_CHROME_FILE_SUFFIX_MAP[uname.system + '-' + uname.machine]
-        return f'chromedriver_{suffix}'
+        return f'chromedriver_{self.WEBDRIVER_CHROME_FILE_SUFFIX_MAP[_PLATFORM_KEY]}'
 
     @staticmethod
     def get_chrome_version():
         """
         :return: the version of chrome installed on client
         """
-        if platform.system() == 'linux':
-            with subprocess.Popen(['chromium-browser', '--version'],
-                                  stdout=subprocess.PIPE) as proc:
-                version = proc.stdout.read().decode('utf-8').replace('Chromium', '').strip()
-                version = version.replace('Google Chrome', '').strip()
-        elif platform.system() == 'Windows':
-            process = subprocess.Popen(
-                ['reg', 'query', 'HKEY_CURRENT_USER\\Software\\Google\\Chrome\\BLBeacon', '/v',
-                 'version'],
-                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL
-            )
-            version = process.communicate()[0].decode('UTF-8').strip().split()[-1]
-        else:
+        probe = _CHROME_VERSION_PROBES.get(_UNAME.system)
+        if probe is None:
             return
-        chrome_ver_reg = re.compile(r'\d+\.\d+\.\d+')
-        version = chrome_ver_reg.search(version).group()
-        return version
+        version = probe()
+        if not version:
+            return None
+        match = _CHROME_VERSION_RE.search(version)
+        return match.group() if match else None
 
     def get_latest_release_for_version(self, version=None):
         """
@@ -209,12 +330,12 @@ class ChromeDownloader(DriverDownloader):
         """
         release_url = self.LATEST_RELEASE_URL + '_{}'.format(version)
         try:
-            response = urlopen(release_url)
-            if response.getcode() != 200:
-                raise URLError('Not Found')
-            return response.read().decode('utf-8').strip()
-        except URLError:
+            response = _SESSION.get(release_url, timeout=10)
+        except requests.RequestException as err:
+            raise RuntimeError('Failed to find release information: {}'.format(release_url)) from err
+        if response.status_code != 200:
             raise RuntimeError('Failed to find release information: {}'.format(release_url))
+        return response.text.strip()
 
     def get_chromedriver_url(self, version):
         """
@@ -227,12 +348,19 @@ class ChromeDownloader(DriverDownloader):
 
     def go(self, target_dir: PathT = None) -> None:
         """Download chrome.exe"""
+        if target_dir is not None:
+            self.directory = target_dir
         chrome_version = self.get_chrome_version()
         latest_stable_release = self.get_latest_release_for_version(chrome_version)
+        if self.is_installed(latest_stable_release):
+            print('chromedriver', latest_stable_release, 'already installed')
+            return
+
         download_url = self.get_chromedriver_url(latest_stable_release)
         fullpath = pjoin(self.directory, self.basename)
-        download_file(download_url, fullpath)
+        cached_download_file(download_url, fullpath)
         assert isfile(fullpath), f'FAILED downloading {download_url} into {fullpath}'
         unarchive(fullpath)
         os.remove(fullpath)
+        self._save_version_file(latest_stable_release)
         print('chromedriver version {}'.format(latest_stable_release))
@@ -1,104 +1,187 @@
 """
 Generate requirements.txt out of a ``pyproject.toml``.
 """
-from typing import Generator, Callable
+from __future__ import annotations
 
+import os
+import re
 import sys
-import argparse
+from contextlib import AbstractContextManager, nullcontext
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11 - fall back to DepExtractor
+    tomllib = None
 
 DEFAULT_INFILE = 'pyproject.toml'
 DEFAULT_OUTFILE = 'stdout'
+BUFFER_SIZE = 64 * 1024
+CACHE_SUFFIX = '.reqcache'  # cache file is named after the input file
+
+# a poetry dependency line - name and optional extras, e.g.
+# b"coverage = {extras = ['toml'], version = '^5.4'}"
+_DEP_RE = re.compile(rb'([A-Za-z0-9][A-Za-z0-9._-]*)\s*=(?:.*?\bextras\s*=\s*\[([^\]]*)\])?')
+
+# quotes and blanks around extras, e.g. b"'socks', 'security'"
+_EXTRA_JUNK = b'\'" \t'
+
+
+def _strip_extra(s: bytes) -> bytes:
+    """Return given extras list content cleaned up of quotes and blanks."""
+    return s.translate(None, _EXTRA_JUNK)
 
 
 class DepExtractor:
     """Collect dependency information from ``pyproject.toml`` and generate
-    ``requirements.txt`` style output appropriate for ``pip install -r``."""
+    ``requirements.txt`` style output appropriate for ``pip install -r``.
+
+    Lines are processed as raw bytes, only the collected names get decoded.
+    """
 
     def __init__(self):
         self._in_dep_section = False
-        self._deps = list()
+        self._parsed_deps = []  # (name, extras) pairs of bytes
 
-    def process(self, line: str) -> None:
+    def process(self, line: bytes) -> None:
         """Parse a line from input file collecting any dependency information."""
-        if not line.strip() and self._in_dep_section:
-            self._in_dep_section = False
-
-        elif 'dependencies]' in line:
-            self._in_dep_section = True
+        stripped = line.strip()
+        if stripped.startswith(b'['):  # a table header starts a new section
+            self._in_dep_section = stripped.endswith(b'dependencies]')
 
         elif self._in_dep_section:
-            if 'python' not in line.split():  # skip python itself ;)
-                self._deps.append(line.strip())
+            if not stripped:
+                self._in_dep_section = False
+                return
+            match = _DEP_RE.match(stripped)
+            if match and match.group(1) != b'python':  # skip python itself ;)
+                name, extras = match.groups()
+                self._parsed_deps.append((name, _strip_extra(extras) if extras else b''))
+
+    def deps(self) -> list[str]:
+        """Return a list of all dependencies, one per item."""
+        return [
+            (name + b'[' + extras + b']' if extras else name).decode('utf-8')
+            for name, extras in self._parsed_deps
+        ]
+
+
+def toml_deps(data: dict) -> list[str]:
+    """Return all dependencies found in parsed ``pyproject.toml`` `data`, one
+    requirement per list item.
+
+    Both PEP 621 ``[project]`` (including optional) and poetry dependency
+    tables are supported.
+    """
+    project = data.get('project', {})
+    result = list(project.get('dependencies', []))
+    for extra_deps in project.get('optional-dependencies', {}).values():
+        result.extend(extra_deps)
+
+    poetry = data.get('tool', {}).get('poetry', {})
+    tables = [poetry.get('dependencies', {}), poetry.get('dev-dependencies', {})]
+    tables.extend(group.get('dependencies', {}) for group in poetry.get('group', {}).values())
+    for table in tables:
+        for name, spec in table.items():
+            if name == 'python':  # skip python itself ;)
+                continue
+            extras = spec.get('extras') if isinstance(spec, dict) else None
+            result.append(f'{name}[{",".join(extras)}]' if extras else name)
+    return result
+
+
+def parse_args(argv: list):
+    """Return an ``argparse.Namespace`` with the parsed command-line `argv`."""
+    import argparse  # only needed with explicit arguments
 
-    def deps(self) -> Generator[str, None, None]:
-        """Return a generator yielding all dependencies, one per yield."""
-
-        def strip_extra(input: str) -> str:
-            """Return given extra after cleaning it up of surrounding characters."""
-            input = input.strip(",")
-            input = input.strip("[]")
-            input = input.strip("'")
-            return input
-
-        for line in self._deps:
-            extras = ''
-            if 'extras' in line:
-                extras = f'[{strip_extra(line.split()[4])}]'
-            yield line.split()[0] + extras
-
-
-def parse_args(argv: list) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Extract requirements from pyproject.toml.')
     parser.add_argument(
         '-i', '--input-file',
         action='store',
-        default='pyproject.toml',
+        default=DEFAULT_INFILE,
         help='the file to read dependencies from (default: %(default)s)',
     )
     parser.add_argument(
         '-o', '--output-file',
         action='store',
-        default='stdout',
+        default=DEFAULT_OUTFILE,
         help='the file to write extracted dependencies to (default: %(default)s)',
     )
     args = parser.parse_args(argv)
     return args
 
 
-def suitable_open_fn(filename: str, inout: str) -> Callable:
-    if inout == 'out' and filename in ('stdout', '-'):
-        return lambda *args: sys.stdout
-    if inout == 'in' and filename in ('stdin', '-'):
-        return lambda *args: sys.stdin
-    return open
+def open_stream(filename: str, mode: str) -> AbstractContextManager:
+    """Return an opened file for `filename`, or the standard input (binary)
+    or output stream for ``stdin``, ``stdout`` and ``-`` - the latter ones
+    are left open on exit from the ``with`` block.
+    """
+    if 'r' in mode and filename in ('stdin', '-'):
+        return nullcontext(sys.stdin.buffer)
+    if 'w' in mode and filename in ('stdout', '-'):
+        return nullcontext(sys.stdout)
+    return open(filename, mode, buffering=BUFFER_SIZE)
 
 
-def _main(argv: list) -> int:
-    args = parse_args(argv)
-    infile = args.input_file
-    outfile = args.output_file
+def read_deps(infile: str) -> list[str]:
+    """Return all dependencies found in `infile`."""
+    with open_stream(infile, 'rb') as fd:
+        if tomllib is not None:
+            return toml_deps(tomllib.load(fd))
 
-    extractor = DepExtractor()
-    with suitable_open_fn(infile, inout='in')(infile, 'r') as fd:
-        for line in fd.readlines():
+        extractor = DepExtractor()
+        for line in fd.read().splitlines():  # small file, read it at once
             extractor.process(line)
-
-    with suitable_open_fn(outfile, inout='out')(outfile, 'w') as fd:
-        for line in extractor.deps():
-            print(line, file=fd)
+        return extractor.deps()
+
+
+def cached_read_deps(infile: str) -> list[str]:
+    """Like :func:`read_deps` but reuse the result cached next to `infile`
+    while its modification time and size (and this script and the parser
+    in use) stay the same."""
+    if infile in ('stdin', '-'):
+        return read_deps(infile)
+
+    stat = os.stat(infile)
+    parser = 'tomllib' if tomllib is not None else 'DepExtractor'
+    key = repr((stat.st_mtime_ns, stat.st_size, os.stat(__file__).st_mtime_ns, parser))
+    cache_file = infile + CACHE_SUFFIX
+    try:
+        with open(cache_file, 'r') as fd:
+            lines = fd.read().splitlines()
+        if lines and lines[0] == key:
+            return lines[1:]
+    except OSError:
+        pass
+
+    deps = read_deps(infile)
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'w') as fd:
+            fd.write('\n'.join([key] + deps) + '\n')
+        os.replace(tmp_file, cache_file)
+    except OSError:  # the cache is optional, e.g. in a read-only directory
+        pass
+    return deps
+
+
+def extract_requirements(infile: str, outfile: str) -> int:
+    """Read dependencies from `infile` and write them to `outfile` in
+    ``requirements.txt`` format."""
+    deps = cached_read_deps(infile)
+
+    with open_stream(outfile, 'w') as fd:
+        if deps:
+            fd.write('\n'.join(deps) + '\n')
 
     return 0
 
 
-def main(argv: list):
-    # try:
-    return _main(argv)
+def main(argv: list) -> int:
+    if not argv:  # the common case, no need for argparse
+        return extract_requirements(DEFAULT_INFILE, DEFAULT_OUTFILE)
 
-    # except FileNotFoundError as err:
-    #     print('Cannot find file:', str(err))
-    # except Exception as err:
-    #     print('ERROR: Unexpected exception:', type(err).__name__, str(err))
-    #     return 1
+    args = parse_args(argv)
+    return extract_requirements(args.input_file, args.output_file)
 
 
 if __name__ == '__main__':